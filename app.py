@@ -4,8 +4,10 @@ Streams browser screenshots so users can solve CAPTCHAs manually,
 then auto-scrapes reviews once past the CAPTCHA.
 """
 
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, Response, stream_with_context
 from flask_cors import CORS
+from flask_compress import Compress
+import orjson
 import json
 import time
 import re
@@ -13,18 +15,246 @@ import threading
 import queue
 import os
 import base64
+import sqlite3
+import zlib
+import itertools
+from collections import OrderedDict
 from urllib.parse import urlparse
 
 app = Flask(__name__)
 CORS(app)
 
-# Store for scraping progress and results
-scrape_jobs = {}
+# Compress JSON responses (/status carries the full reviews list). SSE is
+# left alone: streamed compression would buffer events.
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_MIMETYPES'] = ['application/json']
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_STREAMS'] = False
+Compress(app)
+
+
+class JobStore:
+    """Thread-safe registry of scrape jobs, kept in least-recently-used order.
+
+    Finished jobs (those with a finished_at timestamp) expire ttl seconds
+    after finishing, or at an earlier expires_at set by expire_after(), and
+    are the only ones evicted when over maxsize; a running job is never
+    dropped, however long its CAPTCHA takes.
+    """
+
+    def __init__(self, maxsize=500, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._jobs.move_to_end(job_id)
+            return job
+
+    def put(self, job_id, job):
+        with self._lock:
+            self._jobs[job_id] = job
+
+    def discard(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def sweep(self, now=None):
+        """Drop expired finished jobs, then the least recently used finished ones over maxsize.
+
+        Also deletes persisted results older than JOBS_DB_TTL from SQLite.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.get('finished_at')]
+            overflow = len(self._jobs) - self.maxsize
+            for job_id in finished:
+                job = self._jobs[job_id]
+                if job.get('expires_at', job['finished_at'] + self.ttl) < now or overflow > 0:
+                    del self._jobs[job_id]
+                    overflow -= 1
+        purge_persisted_jobs(now)
+
+    def expire_after(self, job, seconds):
+        """Let a job expire sooner than ttl (never later than already scheduled)."""
+        with self._lock:
+            job['expires_at'] = min(job.get('expires_at', float('inf')), time.time() + seconds)
+
+    def start_reaper(self, interval=300):
+        """Sweep every interval seconds on a daemon thread, so expiry doesn't wait for the next /start."""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap, args=(interval,), daemon=True)
+            self._reaper.start()
+
+    def _reap(self, interval):
+        while True:
+            time.sleep(interval)
+            self.sweep()
+
+
+# Where finished jobs are persisted, and for how long (see persist_job)
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', 'jobs.sqlite')
+JOBS_DB_TTL = int(os.environ.get('JOBS_DB_TTL', 3600))
+
+# Store for scraping progress and results. A finished job never outlives
+# its SQLite row, which is where its reviews are once persisted.
+scrape_jobs = JobStore(maxsize=500, ttl=min(3600, JOBS_DB_TTL))
+
+
+def update_job(job, **fields):
+    """Apply progress fields to a job and wake any SSE streams waiting on it."""
+    with job['_cond']:
+        job.update(fields)
+        job['_version'] += 1
+        job['_cond'].notify_all()
+
+
+def wait_for_job_update(job, seen_version, timeout):
+    """Block until job['_version'] moves past seen_version; False on timeout."""
+    with job['_cond']:
+        return job['_cond'].wait_for(lambda: job['_version'] != seen_version, timeout=timeout)
+
+
+def get_job(job_id):
+    """Return the job dict for job_id, or None if unknown/expired.
+
+    Finished jobs that are no longer in memory (expired, or lost to a
+    restart) are reloaded from SQLite.
+    """
+    job = scrape_jobs.get(job_id)
+    if job is None:
+        job = load_job(job_id)
+        if job is not None:
+            scrape_jobs.put(job_id, job)
+    return job
+
+
+def put_job(job_id, job):
+    """Register a new job."""
+    scrape_jobs.put(job_id, job)
+
+
+# Completed jobs' reviews live in SQLite rather than RAM; the in-memory job
+# keeps only status metadata and reviews are read back on demand. Completed
+# jobs also outlive a restart: get_job() reloads them from here, until the
+# sweep deletes them JOBS_DB_TTL seconds after they finished. Errors looking
+# up a job are logged and treated as a miss; errors reading a persisted job's
+# reviews are reported to the client as retryable.
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db():
+    """Open (once) the shared SQLite connection. Callers hold _db_lock."""
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(JOBS_DB_PATH, check_same_thread=False, isolation_level=None)
+        _db.execute('PRAGMA journal_mode=WAL')
+        _db.execute('PRAGMA synchronous=NORMAL')
+        _db.execute('CREATE TABLE IF NOT EXISTS jobs '
+                    '(id TEXT PRIMARY KEY, meta BLOB, reviews BLOB, finished_at REAL)')
+        # Databases created before finished_at existed
+        columns = {row[1] for row in _db.execute('PRAGMA table_info(jobs)')}
+        if 'finished_at' not in columns:
+            _db.execute('ALTER TABLE jobs ADD COLUMN finished_at REAL')
+    return _db
+
+
+def persist_job(job_id, job):
+    """Write a finished job's metadata and reviews (zlib'd JSON) to SQLite."""
+    meta = {
+        'product_title': job.get('product_title', ''),
+        'product_image': job.get('product_image', ''),
+        'review_count': job.get('review_count', 0),
+        'current_page': job.get('current_page', 0),
+        'max_pages': job.get('max_pages', 0),
+    }
+    blob = zlib.compress(orjson.dumps(job['reviews']))
+    with _db_lock:
+        get_db().execute('INSERT OR REPLACE INTO jobs (id, meta, reviews, finished_at) VALUES (?, ?, ?, ?)',
+                         (job_id, orjson.dumps(meta), blob, job.get('finished_at') or time.time()))
+
+
+def purge_persisted_jobs(now):
+    """Delete persisted jobs that finished more than JOBS_DB_TTL seconds ago."""
+    try:
+        with _db_lock:
+            get_db().execute('DELETE FROM jobs WHERE finished_at IS NULL OR finished_at < ?',
+                             (now - JOBS_DB_TTL,))
+    except sqlite3.Error as db_err:
+        print(f"Could not purge persisted jobs: {db_err}")
+
+
+def load_job(job_id):
+    """Rebuild a completed job from SQLite (reviews stay on disk), or None."""
+    try:
+        with _db_lock:
+            row = get_db().execute('SELECT meta, finished_at FROM jobs WHERE id = ? AND finished_at >= ?',
+                                   (job_id, time.time() - JOBS_DB_TTL)).fetchone()
+    except sqlite3.Error as db_err:
+        print(f"[{job_id}] Could not load persisted job: {db_err}")
+        return None
+    if row is None:
+        return None
+    meta = orjson.loads(row[0])
+    return {
+        'status': 'complete',
+        'message': f"Done! Found {meta.get('review_count', 0)} reviews",
+        'progress': 100,
+        'current_page': meta.get('current_page', 0),
+        'max_pages': meta.get('max_pages', 0),
+        'reviews': None,
+        'review_count': meta.get('review_count', 0),
+        'product_title': meta.get('product_title', ''),
+        'product_image': meta.get('product_image', ''),
+        '_browser_closed': True,
+        '_cond': threading.Condition(),
+        '_version': 0,
+        'finished_at': row[1],
+    }
+
+
+def get_job_reviews(job_id, job):
+    """Reviews for a job: from RAM while scraping, from SQLite once persisted.
+
+    None if the persisted row is gone (purged), in which case the job is
+    dropped from memory too and callers should treat it as not found.
+    A database error is logged and re-raised: the job has reviews we
+    can't read right now, which is not the same as having none.
+    """
+    reviews = job.get('reviews')
+    if reviews is not None:
+        return reviews
+    try:
+        with _db_lock:
+            row = get_db().execute('SELECT reviews FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    except sqlite3.Error as db_err:
+        print(f"[{job_id}] Could not load persisted reviews: {db_err}")
+        raise
+    if row is None:
+        scrape_jobs.discard(job_id)
+        return None
+    return orjson.loads(zlib.decompress(row[0]))
+
+
+# Compiled once; the pattern has no nested quantifiers, so matching is
+# linear in the URL length.
+_PRODUCT_ID_RE = re.compile(r'/(\d{15,20})(?:[/?#]|$)')
+MAX_URL_LENGTH = 2048
 
 
 def extract_product_id(url):
     """Extract product ID from TikTok Shop URL."""
-    match = re.search(r'/(\d{15,20})(?:\?|$)', url)
+    if len(url) > MAX_URL_LENGTH:
+        return None
+    match = _PRODUCT_ID_RE.search(url)
     if match:
         return match.group(1)
     parsed = urlparse(url)
@@ -35,428 +265,834 @@ def extract_product_id(url):
     return None
 
 
+# Column order of the rows scrapePage() returns
+REVIEW_FIELDS = ('username', 'rating', 'review_text', 'date', 'item_variant')
+
+
+def rows_to_reviews(rows):
+    """Rehydrate scrapePage()'s compact [username, rating, ...] rows into review dicts."""
+    return [dict(zip(REVIEW_FIELDS, row)) for row in rows]
+
+
+def dedup_reviews(page_reviews, seen):
+    """Return the reviews from page_reviews not already in seen, updating seen.
+
+    Keys are (username, date, review_text) tuples: the date keeps repeat
+    reviews by the same (masked) user apart, and hashing a tuple of the
+    existing strings avoids building a concatenated key per review.
+    """
+    fresh = []
+    for r in page_reviews:
+        key = (r.get('username', ''), r.get('date', ''), r.get('review_text', ''))
+        if key not in seen:
+            seen.add(key)
+            fresh.append(r)
+    return fresh
+
+
+# In-page helpers, installed once per context with add_init_script so each
+# per-page evaluate only ships a tiny call (e.g. window.__tts.scrapePage(...))
+# instead of re-sending and re-parsing these bodies over CDP every time.
+PAGE_SCRIPT_JS = """(() => {
+    const RATING_SELECTOR = '[aria-label*="Rating:"][aria-label*="out of 5 stars"]';
+    // Non-review lines (badges, variant, dates, counters, masked usernames),
+    // fused into one alternation so each line is tested once, not 7 times
+    const SKIP_LINE_RE = /^(?:(?:Verified|Helpful|Reply|Report|Like|Share)|(?:Item|Color|Size|Variant|Style):|\\d{4}-\\d{2}-\\d{2}$|\\d+\\s*(?:day|week|month|year|hour|min)|\\d+$|Rating:|[A-Za-z0-9]\\*{2,}[A-Za-z0-9]$)/i;
+    // Review-card parsing, compiled once rather than per rating element
+    const RATING_RE = /Rating:\\s*(\\d+(?:\\.\\d+)?)\\s*out of 5/;
+    const CARD_HINT_RE = /\\d{4}-\\d{2}-\\d{2}|[A-Za-z0-9]\\*+[A-Za-z0-9]|ago/;
+    const MASKED_USER_RE = /([A-Za-z0-9]\\*{2,}[A-Za-z0-9])/;
+    const DATE_RE = /(\\d{4}-\\d{2}-\\d{2})/;
+    const RELATIVE_DATE_RE = /(\\d+\\s*(?:day|week|month|year|hour|min)s?\\s*ago)/i;
+    // Group 1 is set for "Item: X", unset for Color:/Size:/...
+    const VARIANT_RE = /^(?:Item:\\s*(.*)|(?:Color|Size|Variant|Style):)/i;
+
+    // Past the CAPTCHA? Returns what was found, or null
+    function detectContent() {
+        // Check for rating elements (reviews section)
+        const ratings = document.querySelectorAll(RATING_SELECTOR);
+        if (ratings.length > 0) return 'reviews';
+
+        // Check for any rating-like elements (TikTok may change aria labels)
+        const stars = document.querySelectorAll('[aria-label*="Rating"]');
+        if (stars.length >= 3) return 'ratings';
+
+        // Check for product title/price (we're past CAPTCHA)
+        const h1 = document.querySelector('h1');
+        const hasPrice = document.querySelector('[class*="price"], [class*="Price"]');
+        if (h1 && h1.innerText.trim().length > 5 && hasPrice) {
+            const title = document.title.toLowerCase();
+            if (!title.includes('security') && !title.includes('verify') && !title.includes('captcha')) {
+                return 'product';
+            }
+        }
 
+        // Check for add-to-cart button (definitely past CAPTCHA)
+        const addToCart = document.querySelector('[class*="AddToCart"], [class*="add-to-cart"], button[aria-label*="Add to cart"]');
+        if (addToCart) return 'product';
 
+        return null;
+    }
 
+    const sleep = (ms) => new Promise(r => setTimeout(r, ms));
+
+    // Resolve once document height stops changing (lazy content settled), capped at maxMs
+    async function waitForStableHeight(maxMs) {
+        const deadline = Date.now() + maxMs;
+        let last = -1;
+        while (Date.now() < deadline) {
+            const h = document.body.scrollHeight;
+            if (h === last) return;
+            last = h;
+            await sleep(120);
+        }
+    }
 
-def scrape_reviews_with_progress(job_id, product_url, max_pages=50):
-    """Scrape reviews with manual CAPTCHA solving via browser view."""
-    job = scrape_jobs[job_id]
-    job['status'] = 'starting'
-    job['message'] = 'Launching browser...'
+    // The pagination's "Next" label, if it has rendered
+    const findNextLabel = () => Array.from(document.querySelectorAll('div.Headline-Semibold'))
+        .find(div => div.innerText.trim() === 'Next');
+
+    // Scroll to the reviews, then far enough down that pagination is visible
+    async function scrollToReviews() {
+        const el = document.querySelector(RATING_SELECTOR)
+            || document.querySelector('[class*="review"], [class*="Review"]');
+        if (el) {
+            el.scrollIntoView({block: 'start'});
+            window.scrollBy(0, -100);
+        } else {
+            window.scrollTo(0, document.body.scrollHeight * 0.6);
+        }
+        await waitForStableHeight(1000);
+        // Pagination already rendered: skip the extra scroll, clickNext() scrolls to it itself
+        if (findNextLabel()) return;
+        window.scrollBy(0, 800);
+        await waitForStableHeight(1000);
+    }
 
-    try:
-        from playwright.sync_api import sync_playwright
-    except ImportError:
-        job['status'] = 'error'
-        job['message'] = 'Playwright not installed.'
+    function productInfo() {
+        let title = '';
+        let image = '';
+
+        const titleEl = document.querySelector('h1') ||
+                       document.querySelector('[class*="title"]') ||
+                       document.querySelector('[class*="Title"]');
+        if (titleEl) title = titleEl.innerText.trim().split('\\n')[0];
+
+        // og:image is there without loading any images (they are blocked once
+        // past the CAPTCHA, which also leaves <img> sizes unreliable)
+        const ogImage = document.querySelector('meta[property="og:image"]');
+        if (ogImage && ogImage.content) return {title, image: ogImage.content};
+
+        // One walk over <img> instead of five selector scans. Container selectors
+        // are in priority order (lower index wins) and match any ancestor, as
+        // '[class*="ProductImage"] img' did; the first image in document order
+        // wins within a rank. The whole list is walked so the large-image
+        // fallback sees every image.
+        const containerSels = ['[class*="ProductImage"]', '[class*="product-image"]',
+                               '[class*="gallery"]', '[class*="slider"]'];
+        let imgEl = null;
+        let bestRank = containerSels.length + 1;
+        let largeSrc = '';
+        for (const img of document.getElementsByTagName('img')) {
+            if (bestRank > 0) {
+                const parent = img.parentElement;
+                let rank = parent ? containerSels.findIndex(sel => parent.closest(sel)) : -1;
+                if (rank < 0 && img.matches('img[class*="product"]')) rank = containerSels.length;
+                if (rank >= 0 && rank < bestRank) {
+                    imgEl = img;
+                    bestRank = rank;
+                }
+            }
+            if (!largeSrc && img.width > 200 && img.height > 200 && img.src) largeSrc = img.src;
+        }
+        if (imgEl) image = imgEl.src || imgEl.getAttribute('data-src') || '';
+        if (!image) image = largeSrc;
+
+        return {title, image};
+    }
+
+    function domDebug() {
+        const info = {};
+        const ratings = document.querySelectorAll('[aria-label*="Rating"]');
+        info.total_rating_elements = ratings.length;
+
+        const ratings_5star = document.querySelectorAll(RATING_SELECTOR);
+        info.rating_5star_elements = ratings_5star.length;
+
+        // Sample first 2 rating elements' parent text
+        info.samples = [];
+        ratings_5star.forEach((el, i) => {
+            if (i >= 2) return;
+            let container = el;
+            for (let j = 0; j < 10; j++) {
+                container = container.parentElement;
+                if (!container) break;
+                if (container.innerText && container.innerText.length > 50) break;
+            }
+            if (container) {
+                info.samples.push(container.innerText.substring(0, 300));
+            }
+        });
+
+        // Check pagination
+        info.pagination = [];
+        const allEls = document.querySelectorAll('button, a, [role="button"]');
+        allEls.forEach(el => {
+            const text = el.innerText?.trim();
+            if (text === 'Next' || text === '>' || text === '›' || /^\\d+$/.test(text)) {
+                const rect = el.getBoundingClientRect();
+                if (rect.width > 0 && rect.top > 200) {
+                    info.pagination.push({text, tag: el.tagName, top: Math.round(rect.top)});
+                }
+            }
+        });
+
+        return info;
+    }
+
+    function extractReviews() {
+        const reviews = [];
+        const ratingElements = document.querySelectorAll(RATING_SELECTOR);
+
+        ratingElements.forEach(ratingEl => {
+            try {
+                const ariaLabel = ratingEl.getAttribute('aria-label');
+                const ratingMatch = ariaLabel.match(RATING_RE);
+                const rating = ratingMatch ? Math.round(parseFloat(ratingMatch[1])) : 0;
+
+                // Walk up to the review card. Keep the last innerText read:
+                // it is the container's text, and innerText forces layout.
+                let container = ratingEl;
+                let fullText = '';
+                for (let i = 0; i < 12; i++) {
+                    container = container.parentElement;
+                    if (!container) break;
+                    fullText = container.innerText || '';
+                    if (fullText.length > 40 && CARD_HINT_RE.test(fullText)) break;
+                }
+
+                if (!container) return;
+                const lines = fullText.split('\\n').map(l => l.trim()).filter(l => l);
+
+                let username = '';
+                const maskedMatch = fullText.match(MASKED_USER_RE);
+                if (maskedMatch) username = maskedMatch[1];
+                if (!username && lines.length > 0) {
+                    const firstLine = lines[0];
+                    if (firstLine.length < 30 && firstLine.length > 1 && !/^\\d/.test(firstLine) && !firstLine.includes('Rating')) {
+                        username = firstLine;
+                    }
+                }
+                if (!username) username = 'Anonymous';
+
+                let date = '';
+                const dateMatch = fullText.match(DATE_RE);
+                if (dateMatch) date = dateMatch[1];
+                else {
+                    const relMatch = fullText.match(RELATIVE_DATE_RE);
+                    if (relMatch) date = relMatch[1];
+                }
+
+                // One pass over the lines: the first variant line (see VARIANT_RE)
+                // and the longest non-skip line. The runner-up (longest line with
+                // different text) stands in if the winner turns out to be the
+                // variant value itself, which can appear before its "Item:" line.
+                let itemVariant = '';
+                let variantFound = false;
+                let reviewText = '';
+                let runnerUp = '';
+                for (const line of lines) {
+                    if (!variantFound) {
+                        const m = line.match(VARIANT_RE);
+                        if (m) { itemVariant = m[1] !== undefined ? m[1] : line; variantFound = true; }
+                    }
+                    if (line.length < 3 || line === username || line === date) continue;
+                    if (SKIP_LINE_RE.test(line)) continue;
+                    if (line.length > reviewText.length) {
+                        if (line !== reviewText) runnerUp = reviewText;
+                        reviewText = line;
+                    } else if (line !== reviewText && line.length > runnerUp.length) {
+                        runnerUp = line;
+                    }
+                }
+                if (variantFound && reviewText === itemVariant) reviewText = runnerUp;
+
+                if (reviewText.length >= 1 || rating > 0) {
+                    // Compact row, same order as REVIEW_FIELDS in Python (no repeated keys over CDP)
+                    reviews.push([username, rating, reviewText || '(no text)', date, itemVariant]);
+                }
+            } catch (e) {}
+        });
+        return reviews;
+    }
+
+    // Click Next button on TikTok pagination
+    function clickNext() {
+        const headlineDivs = document.querySelectorAll('div.Headline-Semibold');
+        for (const div of headlineDivs) {
+            if (div.innerText.trim() === 'Next') {
+                const clickTarget = div.parentElement;
+                if (clickTarget) {
+                    const rect = clickTarget.getBoundingClientRect();
+                    if (rect.width > 0 && rect.height > 0) {
+                        const isDisabled = clickTarget.className.includes('UITextPlaceholder');
+                        if (!isDisabled) {
+                            clickTarget.scrollIntoView({block: 'center'});
+                            clickTarget.click();
+                            return true;
+                        }
+                    }
+                }
+            }
+        }
+        return false;
+    }
+
+    // Resolve once check() passes, re-testing only after the DOM changes
+    // (bursts of mutations are coalesced into one check) instead of polling.
+    function waitForMutation(check, maxMs) {
+        return new Promise(resolve => {
+            // The change may already have happened synchronously (e.g. inside click())
+            if (check()) return resolve(true);
+            let pending = null;
+            const finish = (ok) => {
+                observer.disconnect();
+                clearTimeout(pending);
+                clearTimeout(deadline);
+                resolve(ok);
+            };
+            const observer = new MutationObserver(() => {
+                if (pending !== null) return;
+                pending = setTimeout(() => {
+                    pending = null;
+                    if (check()) finish(true);
+                }, 50);
+            });
+            observer.observe(document.body, {childList: true, subtree: true, characterData: true});
+            const deadline = setTimeout(() => finish(false), maxMs);
+        });
+    }
+
+    const signature = (rows) => rows.length ? rows[0][0] + '|' + rows[0][2] : '';
+
+    // Extract + click Next in ONE evaluate (one CDP round trip per page)
+    async function scrapePage({clickNext: wantNext, maxWaitMs}) {
+        const reviews = extractReviews();
+        let clicked = false;
+        if (wantNext) {
+            clicked = clickNext();
+            if (clicked) {
+                // Wait until the first review changes (next page rendered), capped at maxWaitMs
+                const before = signature(reviews);
+                await waitForMutation(() => {
+                    const now = signature(extractReviews());
+                    return now && now !== before;
+                }, maxWaitMs);
+            }
+        }
+        return {rows: reviews, clicked};
+    }
+
+    // Pagination links carrying a page number (e.g. ?page=2) let pages load in
+    // parallel tabs. Returns the page-2 URL with the number as __PAGE__, or null.
+    function paginationUrlTemplate() {
+        for (const a of document.querySelectorAll('a[href]')) {
+            if (a.innerText.trim() !== '2') continue;
+            const url = new URL(a.href, location.href);
+            for (const [key, value] of url.searchParams) {
+                if (value === '2' && /page/i.test(key)) {
+                    url.searchParams.set(key, '__PAGE__');
+                    return url.toString();
+                }
+            }
+        }
+        return null;
+    }
+
+    window.__tts = {detectContent, scrollToReviews, productInfo, domDebug, scrapePage, paginationUrlTemplate};
+})();"""
+
+
+# Parallel tabs per job when pagination exposes direct page URLs
+PAGE_TABS = max(1, int(os.environ.get('SCRAPER_PAGE_TABS', 3)))
+
+# Per-job browser context settings (fresh context per job, same template)
+CONTEXT_OPTIONS = {
+    'viewport': {"width": 1280, "height": 800},
+    'user_agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+}
+
+# Resource types the review scrape never needs once past the CAPTCHA
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}
+# Analytics/telemetry beacons: never needed for the review DOM
+BLOCKED_URL_RE = re.compile(
+    r'google-analytics\.com|googletagmanager\.com|doubleclick\.net|'
+    r'/api/monitor|//mon[\w.-]*\.tiktokv\.|//mcs[\w.-]*\.tiktokv\.|/web/report'
+)
+
+
+def block_heavy_resources(route):
+    """Playwright route handler: abort image/media/font and tracker requests."""
+    req = route.request
+    if req.resource_type in BLOCKED_RESOURCE_TYPES or BLOCKED_URL_RE.search(req.url):
+        route.abort()
+    else:
+        route.continue_()
+
+
+def scrape_reviews_with_progress(job_id, product_url, max_pages, browser):
+    """Scrape reviews with manual CAPTCHA solving via browser view.
+
+    Runs on a pool worker thread; `browser` is that worker's long-lived
+    Chromium and each job gets its own fresh context.
+    """
+    job = get_job(job_id)
+    if job is None:
         return
+    update_job(job, status='starting', message='Opening browser...')
 
-    reviews = []
+    # Live, append-only: SSE streams read new slices of it while we scrape
+    reviews = job['reviews']
     seen_reviews = set()
+    context = None
 
     try:
-        with sync_playwright() as p:
-            print(f"[{job_id}] Launching local browser...")
-
-            launch_args = [
-                '--no-sandbox',
-                '--disable-setuid-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-blink-features=AutomationControlled',
-            ]
-
-            # Launch browser (without proxy - user solves CAPTCHA manually)
-            browser = p.chromium.launch(
-                headless=True,
-                args=launch_args,
-            )
+        context = browser.new_context(**CONTEXT_OPTIONS)
+        context.add_init_script(PAGE_SCRIPT_JS)
 
-            context = browser.new_context(
-                viewport={"width": 1280, "height": 800},
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-            )
+        page = context.new_page()
+        job['_page'] = page
 
-            page = context.new_page()
-            job['_page'] = page
-            job['_browser'] = browser
+        # Navigate to product page
+        update_job(job, status='captcha', message='Loading page...')
+        print(f"[{job_id}] Navigating to: {product_url}")
 
-            # Navigate to product page
-            job['status'] = 'captcha'
-            job['message'] = 'Loading page...'
-            print(f"[{job_id}] Navigating to: {product_url}")
+        try:
+            page.goto(product_url, timeout=30000, wait_until='domcontentloaded')
+            print(f"[{job_id}] Page loaded")
+        except Exception as nav_err:
+            print(f"[{job_id}] Navigation timeout (continuing): {nav_err}")
 
-            try:
-                page.goto(product_url, timeout=30000, wait_until='domcontentloaded')
-                print(f"[{job_id}] Page loaded")
-            except Exception as nav_err:
-                print(f"[{job_id}] Navigation timeout (continuing): {nav_err}")
+        # Settle until the page has loaded or content is already visible, at most 2s
+        try:
+            page.wait_for_function(
+                "() => document.readyState === 'complete' || (window.__tts && window.__tts.detectContent())",
+                timeout=2000)
+        except Exception:
+            pass
+        update_job(job, message='Please solve the CAPTCHA if shown...')
 
-            page.wait_for_timeout(2000)
-            job['message'] = 'Please solve the CAPTCHA if shown...'
+        # Take initial screenshot
+        try:
+            ss = page.screenshot(type='jpeg', quality=50)
+            job['_screenshot'] = base64.b64encode(ss).decode('utf-8')
+            job['_screenshot_updated'] = time.time()
+            print(f"[{job_id}] Initial screenshot taken ({len(ss)} bytes)")
+        except Exception as ss_err:
+            print(f"[{job_id}] Screenshot error: {ss_err}")
+
+        # Wait for CAPTCHA to be solved (check for review elements or page content)
+        # We give the user up to 3 minutes to solve it
+        captcha_timeout = 180  # seconds
+        start_wait = time.time()
+        captcha_solved = False
+        screenshot_interval = 0.4  # seconds between screenshots
+
+        while time.time() - start_wait < captcha_timeout:
+            if job.get('status') == 'error':
+                break
 
-            # Take initial screenshot
+            # Process any pending mouse/keyboard events from frontend
+            event_queue = job.get('_event_queue')
+            if event_queue:
+                while not event_queue.empty():
+                    try:
+                        evt = event_queue.get_nowait()
+                        evt_type = evt.get('type')
+                        x = evt.get('x', 0)
+                        y = evt.get('y', 0)
+                        if evt_type == 'click':
+                            page.mouse.click(x, y)
+                        elif evt_type == 'mousedown':
+                            page.mouse.move(x, y)
+                            page.mouse.down()
+                        elif evt_type == 'mouseup':
+                            page.mouse.move(x, y)
+                            page.mouse.up()
+                        elif evt_type == 'mousemove':
+                            page.mouse.move(x, y)
+                        elif evt_type == 'scroll':
+                            page.mouse.wheel(evt.get('deltaX', 0), evt.get('deltaY', 0))
+                        elif evt_type == 'keydown':
+                            key = evt.get('key', '')
+                            if key:
+                                page.keyboard.press(key)
+                    except Exception as evt_err:
+                        print(f"[{job_id}] Event error: {evt_err}")
+
+            # Take screenshot for streaming to frontend
             try:
                 ss = page.screenshot(type='jpeg', quality=50)
                 job['_screenshot'] = base64.b64encode(ss).decode('utf-8')
                 job['_screenshot_updated'] = time.time()
-                print(f"[{job_id}] Initial screenshot taken ({len(ss)} bytes)")
-            except Exception as ss_err:
-                print(f"[{job_id}] Screenshot error: {ss_err}")
-
-            # Wait for CAPTCHA to be solved (check for review elements or page content)
-            # We give the user up to 3 minutes to solve it
-            captcha_timeout = 180  # seconds
-            start_wait = time.time()
-            captcha_solved = False
-            screenshot_interval = 0.4  # seconds between screenshots
-
-            while time.time() - start_wait < captcha_timeout:
-                if job.get('status') == 'error':
+            except Exception:
+                pass
+
+            # Check if page has reviews or product content (CAPTCHA solved)
+            try:
+                has_content = page.evaluate("() => window.__tts.detectContent()")
+
+                if has_content:
+                    captcha_solved = True
+                    print(f"[{job_id}] CAPTCHA solved! Found: {has_content}")
                     break
+            except Exception:
+                pass
 
-                # Process any pending mouse/keyboard events from frontend
-                event_queue = job.get('_event_queue')
-                if event_queue:
-                    while not event_queue.empty():
-                        try:
-                            evt = event_queue.get_nowait()
-                            evt_type = evt.get('type')
-                            x = evt.get('x', 0)
-                            y = evt.get('y', 0)
-                            if evt_type == 'click':
-                                page.mouse.click(x, y)
-                            elif evt_type == 'mousedown':
-                                page.mouse.move(x, y)
-                                page.mouse.down()
-                            elif evt_type == 'mouseup':
-                                page.mouse.move(x, y)
-                                page.mouse.up()
-                            elif evt_type == 'mousemove':
-                                page.mouse.move(x, y)
-                            elif evt_type == 'scroll':
-                                page.mouse.wheel(evt.get('deltaX', 0), evt.get('deltaY', 0))
-                            elif evt_type == 'keydown':
-                                key = evt.get('key', '')
-                                if key:
-                                    page.keyboard.press(key)
-                        except Exception as evt_err:
-                            print(f"[{job_id}] Event error: {evt_err}")
-
-                # Take screenshot for streaming to frontend
-                try:
-                    ss = page.screenshot(type='jpeg', quality=50)
-                    job['_screenshot'] = base64.b64encode(ss).decode('utf-8')
-                    job['_screenshot_updated'] = time.time()
-                except Exception:
-                    pass
+            time.sleep(screenshot_interval)
 
-                # Check if page has reviews or product content (CAPTCHA solved)
-                try:
-                    has_content = page.evaluate("""() => {
-                        // Check for rating elements (reviews section)
-                        const ratings = document.querySelectorAll('[aria-label*="Rating:"][aria-label*="out of 5 stars"]');
-                        if (ratings.length > 0) return 'reviews';
-
-                        // Check for any rating-like elements (TikTok may change aria labels)
-                        const stars = document.querySelectorAll('[aria-label*="Rating"]');
-                        if (stars.length >= 3) return 'ratings';
-
-                        // Check for product title/price (we're past CAPTCHA)
-                        const h1 = document.querySelector('h1');
-                        const hasPrice = document.querySelector('[class*="price"], [class*="Price"]');
-                        if (h1 && h1.innerText.trim().length > 5 && hasPrice) {
-                            const title = document.title.toLowerCase();
-                            if (!title.includes('security') && !title.includes('verify') && !title.includes('captcha')) {
-                                return 'product';
-                            }
-                        }
+        if not captcha_solved:
+            update_job(job, status='error', message='CAPTCHA was not solved in time. Please try again.')
+            return
 
-                        // Check for add-to-cart button (definitely past CAPTCHA)
-                        const addToCart = document.querySelector('[class*="AddToCart"], [class*="add-to-cart"], button[aria-label*="Add to cart"]');
-                        if (addToCart) return 'product';
+        # CAPTCHA solved - proceed with scraping
+        update_job(job, status='scraping', message='CAPTCHA solved! Scraping reviews...')
+        print(f"[{job_id}] Starting review extraction...")
 
-                        return null;
-                    }""")
+        # Stop screenshot streaming
+        job['_screenshot'] = None
 
-                    if has_content:
-                        captcha_solved = True
-                        print(f"[{job_id}] CAPTCHA solved! Found: {has_content}")
-                        break
-                except Exception:
-                    pass
+        # Stop downloading images/video/fonts. Only now: the user needs to
+        # see images to solve the CAPTCHA. Already-set img.src values stay
+        # readable for product info.
+        context.route('**/*', block_heavy_resources)
 
-                time.sleep(screenshot_interval)
+        # Scroll directly to reviews section (fast)
+        update_job(job, message='Finding reviews section...')
+        page.evaluate("() => window.__tts.scrollToReviews()")
 
-            if not captcha_solved:
-                job['status'] = 'error'
-                job['message'] = 'CAPTCHA was not solved in time. Please try again.'
-                try:
-                    browser.close()
-                except Exception:
-                    pass
-                job['_browser_closed'] = True
-                return
+        # Extract product info
+        product_info = page.evaluate("() => window.__tts.productInfo()")
 
-            # CAPTCHA solved - proceed with scraping
-            job['status'] = 'scraping'
-            job['message'] = 'CAPTCHA solved! Scraping reviews...'
-            print(f"[{job_id}] Starting review extraction...")
-
-            # Stop screenshot streaming
-            job['_screenshot'] = None
-
-            # Scroll directly to reviews section (fast)
-            job['message'] = 'Finding reviews section...'
-            page.evaluate("""() => {
-                const el = document.querySelector('[aria-label*="Rating:"][aria-label*="out of 5 stars"]')
-                    || document.querySelector('[class*="review"], [class*="Review"]');
-                if (el) {
-                    el.scrollIntoView({block: 'start'});
-                    window.scrollBy(0, -100);
-                } else {
-                    window.scrollTo(0, document.body.scrollHeight * 0.6);
-                }
-            }""")
-            page.wait_for_timeout(500)
-            # One more scroll down to ensure pagination is visible
-            page.evaluate("window.scrollBy(0, 800)")
-            page.wait_for_timeout(500)
-
-            # Extract product info
-            product_info = page.evaluate("""() => {
-                let title = '';
-                let image = '';
-
-                const titleEl = document.querySelector('h1') ||
-                               document.querySelector('[class*="title"]') ||
-                               document.querySelector('[class*="Title"]');
-                if (titleEl) title = titleEl.innerText.trim().split('\\n')[0];
-
-                const imgEl = document.querySelector('[class*="ProductImage"] img') ||
-                             document.querySelector('[class*="product-image"] img') ||
-                             document.querySelector('[class*="gallery"] img') ||
-                             document.querySelector('[class*="slider"] img') ||
-                             document.querySelector('img[class*="product"]');
-                if (imgEl) image = imgEl.src || imgEl.getAttribute('data-src') || '';
-
-                if (!image) {
-                    const imgs = document.querySelectorAll('img');
-                    for (const img of imgs) {
-                        if (img.width > 200 && img.height > 200 && img.src) {
-                            image = img.src;
-                            break;
-                        }
-                    }
-                }
+        job['product_title'] = product_info.get('title', '')
+        job['product_image'] = product_info.get('image', '')
+        print(f"[{job_id}] Product: {job['product_title'][:50]}")
 
-                return {title, image};
-            }""")
+        # Collect DOM debug info on first page
+        try:
+            dom_debug = page.evaluate("() => window.__tts.domDebug()")
+            print(f"[{job_id}] DOM Debug: {json.dumps(dom_debug, indent=2)}")
+            job['_dom_debug'] = dom_debug
+        except Exception as debug_err:
+            print(f"[{job_id}] DOM debug error: {debug_err}")
+
+        # Helper: scrape a range of pages using a given tab
+        def scrape_page_range(tab, start_page, end_page, worker_id):
+            """Scrape pages start_page through end_page on given tab into `reviews`."""
+            current = start_page
+
+            while current <= end_page:
+                # Extract reviews and click Next in a single round trip
+                result = tab.evaluate("args => window.__tts.scrapePage(args)",
+                                      {'clickNext': current < end_page, 'maxWaitMs': 8000})
+                page_reviews = rows_to_reviews(result.get('rows') or [])
+                # Dedup as we go using username + date + review_text
+                reviews.extend(dedup_reviews(page_reviews, seen_reviews))
+                print(f"[{job_id}][W{worker_id}] Page {current}: {len(page_reviews)} raw, {len(reviews)} unique total")
+
+                # Update job progress every page
+                update_job(job,
+                           current_page=max(job.get('current_page', 0), current),
+                           message=f'Scraping page {current}...',
+                           progress=int((current / max_pages) * 100),
+                           review_count=len(reviews))
+
+                if current >= end_page:
+                    break
 
-            job['product_title'] = product_info.get('title', '')
-            job['product_image'] = product_info.get('image', '')
-            print(f"[{job_id}] Product: {job['product_title'][:50]}")
+                if not result.get('clicked'):
+                    print(f"[{job_id}][W{worker_id}] No Next button at page {current}")
+                    break
 
-            # Collect DOM debug info on first page
+                current += 1
+
+        # Helper: load pages 2..max_pages through direct URLs, PAGE_TABS at a time
+        def scrape_pages_in_tabs(url_template):
+            """Fan pages out over parallel tabs; returns (done, resume_page).
+
+            When not done, the caller clicks Next serially from resume_page:
+            1 if no page past 1 yields new reviews, else the first page whose
+            tab failed (navigation, timeout, CAPTCHA). Only a batch whose
+            tabs all loaded and added nothing new ends the run: either we're
+            past the last page, or the site ignores the page parameter and
+            keeps serving page 1 (the caller then falls back to clicking Next).
+            """
+            first = page.evaluate("args => window.__tts.scrapePage(args)", {'clickNext': False, 'maxWaitMs': 0})
+            reviews.extend(dedup_reviews(rows_to_reviews(first.get('rows') or []), seen_reviews))
+            found_more = False
+            tabs = [context.new_page() for _ in range(min(PAGE_TABS, max_pages - 1))]
             try:
-                dom_debug = page.evaluate("""() => {
-                    const info = {};
-                    const ratings = document.querySelectorAll('[aria-label*="Rating"]');
-                    info.total_rating_elements = ratings.length;
-
-                    const ratings_5star = document.querySelectorAll('[aria-label*="Rating:"][aria-label*="out of 5 stars"]');
-                    info.rating_5star_elements = ratings_5star.length;
-
-                    // Sample first 2 rating elements' parent text
-                    info.samples = [];
-                    ratings_5star.forEach((el, i) => {
-                        if (i >= 2) return;
-                        let container = el;
-                        for (let j = 0; j < 10; j++) {
-                            container = container.parentElement;
-                            if (!container) break;
-                            if (container.innerText && container.innerText.length > 50) break;
-                        }
-                        if (container) {
-                            info.samples.push(container.innerText.substring(0, 300));
-                        }
-                    });
-
-                    // Check pagination
-                    info.pagination = [];
-                    const allEls = document.querySelectorAll('button, a, [role="button"]');
-                    allEls.forEach(el => {
-                        const text = el.innerText?.trim();
-                        if (text === 'Next' || text === '>' || text === '›' || /^\\d+$/.test(text)) {
-                            const rect = el.getBoundingClientRect();
-                            if (rect.width > 0 && rect.top > 200) {
-                                info.pagination.push({text, tag: el.tagName, top: Math.round(rect.top)});
-                            }
-                        }
-                    });
-
-                    return info;
-                }""")
-                print(f"[{job_id}] DOM Debug: {json.dumps(dom_debug, indent=2)}")
-                job['_dom_debug'] = dom_debug
-            except Exception as debug_err:
-                print(f"[{job_id}] DOM debug error: {debug_err}")
-
-            # Helper: extract reviews from a page
-            def extract_reviews_js():
-                return """() => {
-                    const reviews = [];
-                    const ratingElements = document.querySelectorAll('[aria-label*="Rating:"][aria-label*="out of 5 stars"]');
-
-                    ratingElements.forEach(ratingEl => {
-                        try {
-                            const ariaLabel = ratingEl.getAttribute('aria-label');
-                            const ratingMatch = ariaLabel.match(/Rating:\\s*(\\d+(?:\\.\\d+)?)\\s*out of 5/);
-                            const rating = ratingMatch ? Math.round(parseFloat(ratingMatch[1])) : 0;
-
-                            let container = ratingEl;
-                            for (let i = 0; i < 12; i++) {
-                                container = container.parentElement;
-                                if (!container) break;
-                                const text = container.innerText || '';
-                                if (text.length > 40 && (
-                                    /\\d{4}-\\d{2}-\\d{2}/.test(text) ||
-                                    /[A-Za-z0-9]\\*+[A-Za-z0-9]/.test(text) ||
-                                    /ago/.test(text)
-                                )) break;
-                            }
-
-                            if (!container) return;
-                            const fullText = container.innerText || '';
-                            const lines = fullText.split('\\n').map(l => l.trim()).filter(l => l);
-
-                            let username = '';
-                            const maskedMatch = fullText.match(/([A-Za-z0-9]\\*{2,}[A-Za-z0-9])/);
-                            if (maskedMatch) username = maskedMatch[1];
-                            if (!username && lines.length > 0) {
-                                const firstLine = lines[0];
-                                if (firstLine.length < 30 && firstLine.length > 1 && !/^\\d/.test(firstLine) && !firstLine.includes('Rating')) {
-                                    username = firstLine;
-                                }
-                            }
-                            if (!username) username = 'Anonymous';
-
-                            let date = '';
-                            const dateMatch = fullText.match(/(\\d{4}-\\d{2}-\\d{2})/);
-                            if (dateMatch) date = dateMatch[1];
-                            else {
-                                const relMatch = fullText.match(/(\\d+\\s*(?:day|week|month|year|hour|min)s?\\s*ago)/i);
-                                if (relMatch) date = relMatch[1];
-                            }
-
-                            let itemVariant = '';
-                            for (const line of lines) {
-                                if (/^Item:/i.test(line)) { itemVariant = line.replace(/^Item:\\s*/i, ''); break; }
-                                if (/^(Color|Size|Variant|Style):/i.test(line)) { itemVariant = line; break; }
-                            }
-
-                            let reviewText = '';
-                            const skipPats = [/^(Verified|Helpful|Reply|Report|Like|Share)/i, /^(Item:|Color:|Size:|Variant:|Style:)/i,
-                                /^\\d{4}-\\d{2}-\\d{2}$/, /^\\d+\\s*(day|week|month|year|hour|min)/i, /^\\d+$/, /^Rating:/, /^[A-Za-z0-9]\\*{2,}[A-Za-z0-9]$/];
-                            for (const line of lines) {
-                                if (line.length < 3 || line === username || line === itemVariant || line === date) continue;
-                                let skip = false;
-                                for (const p of skipPats) { if (p.test(line)) { skip = true; break; } }
-                                if (!skip && line.length > reviewText.length) reviewText = line;
-                            }
-
-                            if (reviewText.length >= 1 || rating > 0) {
-                                reviews.push({ username, rating, review_text: reviewText || '(no text)', date, item_variant: itemVariant });
-                            }
-                        } catch (e) {}
-                    });
-                    return reviews;
-                }"""
-
-            # Helper: click Next button on TikTok pagination
-            def click_next_js():
-                return """() => {
-                    const headlineDivs = document.querySelectorAll('div.Headline-Semibold');
-                    for (const div of headlineDivs) {
-                        if (div.innerText.trim() === 'Next') {
-                            const clickTarget = div.parentElement;
-                            if (clickTarget) {
-                                const rect = clickTarget.getBoundingClientRect();
-                                if (rect.width > 0 && rect.height > 0) {
-                                    const isDisabled = clickTarget.className.includes('UITextPlaceholder');
-                                    if (!isDisabled) {
-                                        clickTarget.scrollIntoView({block: 'center'});
-                                        clickTarget.click();
-                                        return true;
-                                    }
-                                }
-                            }
-                        }
-                    }
-                    return false;
-                }"""
-
-
-            # Helper: scrape a range of pages using a given tab
-            def scrape_page_range(tab, start_page, end_page, worker_id):
-                """Scrape pages start_page through end_page on given tab."""
-                worker_reviews = []
-                current = start_page
-
-                while current <= end_page:
-                    # Extract reviews
-                    page_reviews = tab.evaluate(extract_reviews_js())
-                    if isinstance(page_reviews, list) and len(page_reviews) > 0:
-                        # Dedup as we go using review_text + username
-                        for r in page_reviews:
-                            key = (r.get('username', '') + '|' + r.get('review_text', '')).strip()
-                            if key and key not in seen_reviews:
-                                seen_reviews.add(key)
-                                worker_reviews.append(r)
-                    print(f"[{job_id}][W{worker_id}] Page {current}: {len(page_reviews) if isinstance(page_reviews, list) else 0} raw, {len(worker_reviews)} unique total")
-
-                    # Update job progress every page
-                    job['current_page'] = max(job.get('current_page', 0), current)
-                    job['message'] = f'Scraping page {current}...'
-                    job['progress'] = int((current / max_pages) * 100)
-                    job['review_count'] = len(worker_reviews)
-
-                    if current >= end_page:
-                        break
+                for batch_start in range(2, max_pages + 1, len(tabs)):
+                    batch = list(zip(tabs, range(batch_start, min(batch_start + len(tabs), max_pages + 1))))
+                    # Start every navigation first ('commit' returns early) so the pages load concurrently
+                    loading = []
+                    failed = []
+                    for tab, page_num in batch:
+                        try:
+                            tab.goto(url_template.replace('__PAGE__', str(page_num)), wait_until='commit', timeout=30000)
+                            loading.append(page_num)
+                        except Exception as nav_err:
+                            print(f"[{job_id}] Page {page_num} navigation error: {nav_err}")
+                            failed.append(page_num)
+
+                    batch_new = 0
+                    for tab, page_num in batch:
+                        page_reviews = []
+                        if page_num in loading:
+                            try:
+                                tab.wait_for_function("() => window.__tts && window.__tts.detectContent() === 'reviews'",
+                                                      timeout=15000)
+                                result = tab.evaluate("args => window.__tts.scrapePage(args)",
+                                                      {'clickNext': False, 'maxWaitMs': 0})
+                                page_reviews = rows_to_reviews(result.get('rows') or [])
+                            except Exception as tab_err:
+                                print(f"[{job_id}] Page {page_num} tab error: {tab_err}")
+                                failed.append(page_num)
+                        fresh = dedup_reviews(page_reviews, seen_reviews)
+                        batch_new += len(fresh)
+                        reviews.extend(fresh)
+                        print(f"[{job_id}][tabs] Page {page_num}: {len(page_reviews)} raw, {len(reviews)} unique total")
+
+                        update_job(job,
+                                   current_page=max(job.get('current_page', 0), page_num),
+                                   message=f'Scraping page {page_num}...',
+                                   progress=int((page_num / max_pages) * 100),
+                                   review_count=len(reviews))
+
+                    if failed:
+                        print(f"[{job_id}][tabs] Pages {failed} failed, resuming serially from page {min(failed)}")
+                        return False, min(failed)
+                    if not batch_new:
+                        break  # past the last page, or the page parameter is ignored
+                    found_more = True
+            finally:
+                for tab in tabs:
+                    try:
+                        tab.close()
+                    except Exception:
+                        pass
+            return found_more, 1
+
+        print(f"[{job_id}] Scraping {max_pages} pages...")
+        url_template = page.evaluate("() => window.__tts.paginationUrlTemplate()") if max_pages > 1 else None
+        if url_template:
+            print(f"[{job_id}] Direct page URLs found, loading pages in parallel: {url_template}")
+        done, resume_page = scrape_pages_in_tabs(url_template) if url_template else (False, 1)
+        if not done:
+            # Serial click-Next loop (anything already collected dedups away).
+            # After a failed tab, resume from that page in a fresh tab; the
+            # main page stays on page 1 as the fallback if it won't load.
+            resume_tab = None
+            serial_page = page
+            if resume_page > 1:
+                resume_tab = context.new_page()
+                try:
+                    resume_tab.goto(url_template.replace('__PAGE__', str(resume_page)), wait_until='commit', timeout=30000)
+                    resume_tab.wait_for_function("() => window.__tts && window.__tts.detectContent() === 'reviews'",
+                                                 timeout=15000)
+                    serial_page = resume_tab
+                except Exception as nav_err:
+                    print(f"[{job_id}] Could not reopen page {resume_page} ({nav_err}), clicking through from page 1")
+                    resume_page = 1
+            try:
+                scrape_page_range(serial_page, resume_page, max_pages, 0)
+            finally:
+                if resume_tab is not None:
+                    try:
+                        resume_tab.close()
+                    except Exception:
+                        pass
+
+        # Move the reviews to disk; readers fall back to SQLite once this is None.
+        # One finished_at for RAM and disk, so both copies expire together.
+        job['finished_at'] = time.time()
+        try:
+            persist_job(job_id, job)
+            job['reviews'] = None
+        except Exception as db_err:
+            print(f"[{job_id}] Could not persist reviews (keeping in memory): {db_err}")
 
-                    # Click Next
-                    clicked = tab.evaluate(click_next_js())
-                    if not clicked:
-                        print(f"[{job_id}][W{worker_id}] No Next button at page {current}")
+        update_job(job, status='complete', message=f'Done! Found {len(reviews)} reviews', progress=100)
+
+    except Exception as e:
+        print(f"[{job_id}] ERROR: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        update_job(job, status='error', message=f'Error: {str(e)}')
+
+    finally:
+        # Only the context is per-job; the browser stays up for the next job
+        if context is not None:
+            try:
+                context.close()
+            except Exception:
+                pass
+        job['_page'] = None
+        job['_browser_closed'] = True
+        job.setdefault('finished_at', time.time())
+
+
+# Browser worker pool: each worker thread owns one long-lived Chromium and
+# runs queued jobs in fresh contexts, so the browser is launched once per
+# worker instead of once per job. Also caps concurrent browser sessions.
+SCRAPER_WORKERS = int(os.environ.get('SCRAPER_WORKERS', 2))
+job_queue = queue.Queue()
+_workers = []
+_worker_ids = itertools.count()
+_workers_lock = threading.Lock()
+_down_workers = set()  # ids of workers backing off after a browser failure
+
+
+def mark_worker_down(worker_id, down):
+    """Record whether a pool worker currently has no usable browser."""
+    with _workers_lock:
+        if down:
+            _down_workers.add(worker_id)
+        else:
+            _down_workers.discard(worker_id)
+
+
+def pool_down():
+    """True when every pool worker is without a browser."""
+    with _workers_lock:
+        return len(_down_workers) >= SCRAPER_WORKERS
+
+
+def fail_job(job_id, message):
+    """Mark a queued job as failed before it reached a browser."""
+    job = get_job(job_id)
+    if job is not None:
+        update_job(job, status='error', message=message, _browser_closed=True, finished_at=time.time())
+
+
+# Chromium flags, shared by every pool worker's launch. Playwright already
+# adds the usual quiet-headless set (no background networking, sync, first
+# run, default apps; muted audio). --single-process is deliberately absent:
+# it is unsupported with multiple contexts/tabs and crashes under load.
+BROWSER_LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-blink-features=AutomationControlled',
+    # One renderer per tab instead of extra processes for cross-site iframes
+    '--disable-site-isolation-trials',
+]
+
+
+def launch_browser(p, worker_id):
+    """Launch this worker's Chromium."""
+    print(f"[W{worker_id}] Launching local browser...")
+    # Launch browser (without proxy - user solves CAPTCHA manually)
+    return p.chromium.launch(
+        headless=True,
+        args=BROWSER_LAUNCH_ARGS,
+    )
+
+
+def browser_worker(worker_id):
+    """Pool worker: keep one warm Chromium and scrape jobs from job_queue.
+
+    The browser is launched up front and relaunched before a job if it
+    has crashed or disconnected. If a launch fails, or Playwright itself
+    does, the worker restarts Playwright with exponential backoff, handing
+    the job in hand back to the pool meanwhile.
+    """
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        while True:
+            job_id, _, _ = job_queue.get()
+            fail_job(job_id, 'Playwright not installed.')
+
+    backoff = 1
+    while True:
+        task = None
+        try:
+            with sync_playwright() as p:
+                browser = launch_browser(p, worker_id)
+                mark_worker_down(worker_id, False)
+                backoff = 1
+
+                while True:
+                    task = job_queue.get()
+                    job_id, product_url, max_pages = task
+                    print(f"[W{worker_id}] Picked up {job_id}")
+
+                    if not browser.is_connected():
+                        print(f"[W{worker_id}] Browser disconnected, relaunching")
+                        # A failed relaunch restarts Playwright below
+                        browser = launch_browser(p, worker_id)
+
+                    scrape_reviews_with_progress(job_id, product_url, max_pages, browser)
+                    task = None
+        except Exception as pw_err:
+            # The browser or Playwright itself failed: never let the thread die
+            # with jobs stuck 'queued'. Leave the queue to healthy workers while
+            # backing off, then start Playwright again.
+            print(f"[W{worker_id}] Browser unavailable, restarting Playwright in {backoff}s: {pw_err}")
+            mark_worker_down(worker_id, True)
+            message = f'Error: browser unavailable ({pw_err})'
+            if task is not None:
+                job = get_job(task[0])
+                if job is not None and job['status'] == 'queued':
+                    job_queue.put(task)  # never started: let another worker take it
+                else:
+                    fail_job(task[0], message)
+            if pool_down():
+                # No worker can run anything: fail what's waiting rather than
+                # leave it queued until a browser comes back
+                while True:
+                    try:
+                        queued_id, _, _ = job_queue.get_nowait()
+                    except queue.Empty:
                         break
+                    fail_job(queued_id, message)
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
 
-                    # Wait for page content to change (500ms fixed - reliable and fast)
-                    tab.wait_for_timeout(500)
-                    current += 1
 
-                return worker_reviews
+def ensure_workers():
+    """Start the browser worker threads on first use, replacing any that died."""
+    with _workers_lock:
+        _workers[:] = [worker for worker in _workers if worker.is_alive()]
+        while len(_workers) < SCRAPER_WORKERS:
+            worker = threading.Thread(target=browser_worker, args=(next(_worker_ids),))
+            worker.daemon = True
+            worker.start()
+            _workers.append(worker)
 
-            # Single fast loop
-            print(f"[{job_id}] Scraping {max_pages} pages...")
-            reviews = scrape_page_range(page, 1, max_pages, 0)
 
-            job['reviews'] = reviews
-            job['review_count'] = len(reviews)
+def json_response(payload):
+    """JSON response body encoded with orjson (drop-in for jsonify)."""
+    return Response(orjson.dumps(payload), mimetype='application/json')
 
-            job['status'] = 'complete'
-            job['message'] = f'Done! Found {len(reviews)} reviews'
-            job['progress'] = 100
 
-            browser.close()
-            job['_browser_closed'] = True
+def sse_data(payload):
+    """Encode one SSE data frame as bytes, straight from orjson (no str round trip)."""
+    return b'data: ' + orjson.dumps(payload) + b'\n\n'
 
-    except Exception as e:
-        print(f"[{job_id}] ERROR: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        job['status'] = 'error'
-        job['message'] = f'Error: {str(e)}'
-        job['_browser_closed'] = True
+
+def gzip_stream(frames):
+    """Gzip an SSE frame generator, sync-flushing after every frame.
+
+    The flush keeps each event deliverable as soon as it is yielded while
+    later frames (and the big final reviews frame) still share one
+    compression window.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for frame in frames:
+        yield compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
 
 
 @app.route('/start', methods=['POST'])
@@ -466,17 +1102,20 @@ def start_scrape():
     max_pages = int(data.get('max_pages', 50))
 
     if not url:
-        return jsonify({'error': 'URL is required'}), 400
+        return json_response({'error': 'URL is required'}), 400
 
     product_id = extract_product_id(url)
     if not product_id:
-        return jsonify({'error': 'Invalid TikTok Shop URL. Could not find product ID.'}), 400
+        return json_response({'error': 'Invalid TikTok Shop URL. Could not find product ID.'}), 400
+
+    # Expire old finished jobs before adding another
+    scrape_jobs.sweep()
 
     # Create job
     job_id = f"job_{int(time.time() * 1000)}"
-    scrape_jobs[job_id] = {
+    put_job(job_id, {
         'status': 'queued',
-        'message': 'Starting...',
+        'message': 'Waiting for a free browser...',
         'progress': 0,
         'current_page': 0,
         'max_pages': max_pages,
@@ -484,57 +1123,64 @@ def start_scrape():
         'review_count': 0,
         '_browser_closed': False,
         '_event_queue': queue.Queue(),
-    }
+        '_cond': threading.Condition(),
+        '_version': 0,
+    })
 
-    # Start scraping in background thread
-    thread = threading.Thread(
-        target=scrape_reviews_with_progress,
-        args=(job_id, url, max_pages)
-    )
-    thread.daemon = True
-    thread.start()
+    # Hand off to the browser worker pool
+    ensure_workers()
+    scrape_jobs.start_reaper()
+    job_queue.put((job_id, url, max_pages))
 
-    return jsonify({'job_id': job_id, 'product_id': product_id})
+    return json_response({'job_id': job_id, 'product_id': product_id})
 
 
 @app.route('/status/<job_id>')
 def get_status(job_id):
-    if job_id not in scrape_jobs:
-        return jsonify({'error': 'Job not found'}), 404
+    job = get_job(job_id)
+    if job is None:
+        return json_response({'error': 'Job not found'}), 404
 
-    job = scrape_jobs[job_id]
-    return jsonify({
+    try:
+        reviews = get_job_reviews(job_id, job) if job['status'] == 'complete' else []
+    except sqlite3.Error:
+        return json_response({'error': 'Could not load reviews, please retry'}), 503
+    if reviews is None:
+        return json_response({'error': 'Job not found'}), 404
+
+    payload = {
         'status': job['status'],
         'message': job['message'],
         'progress': job['progress'],
         'current_page': job.get('current_page', 0),
         'max_pages': job.get('max_pages', 0),
         'review_count': job.get('review_count', 0),
-        'reviews': job.get('reviews', []) if job['status'] == 'complete' else [],
+        'reviews': reviews,
         'product_title': job.get('product_title', ''),
         'product_image': job.get('product_image', ''),
         'has_screenshot': bool(job.get('_screenshot')),
-    })
+    }
+    return json_response(payload)
 
 
 @app.route('/browser-stream/<job_id>')
 def browser_stream(job_id):
     """SSE endpoint that streams browser screenshots as base64 JPEG."""
-    if job_id not in scrape_jobs:
-        return jsonify({'error': 'Job not found'}), 404
+    if get_job(job_id) is None:
+        return json_response({'error': 'Job not found'}), 404
 
     def generate():
         last_sent = 0
         while True:
-            if job_id not in scrape_jobs:
-                yield f"data: {json.dumps({'type': 'done'})}\n\n"
+            job = get_job(job_id)
+            if job is None:
+                yield sse_data({'type': 'done'})
                 break
 
-            job = scrape_jobs[job_id]
-
-            # If no longer in captcha state, send done
-            if job['status'] not in ('captcha', 'loading', 'starting'):
-                yield f"data: {json.dumps({'type': 'solved', 'status': job['status']})}\n\n"
+            # If no longer in captcha state, send done. A queued job is still
+            # waiting for a free worker: keep the stream open, no frames yet.
+            if job['status'] not in ('queued', 'captcha', 'loading', 'starting'):
+                yield sse_data({'type': 'solved', 'status': job['status']})
                 break
 
             # Send screenshot if updated
@@ -542,76 +1188,136 @@ def browser_stream(job_id):
             updated = job.get('_screenshot_updated', 0)
 
             if screenshot and updated > last_sent:
-                yield f"data: {json.dumps({'type': 'frame', 'image': screenshot})}\n\n"
+                yield sse_data({'type': 'frame', 'image': screenshot})
                 last_sent = updated
 
             time.sleep(0.3)
 
-    return Response(generate(), mimetype='text/event-stream',
-                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+                    direct_passthrough=True)
 
 
 @app.route('/browser-event/<job_id>', methods=['POST'])
 def browser_event(job_id):
     """Receive mouse/keyboard events from frontend and queue them for the browser."""
-    if job_id not in scrape_jobs:
-        return jsonify({'error': 'Job not found'}), 404
-
-    job = scrape_jobs[job_id]
+    job = get_job(job_id)
+    if job is None:
+        return json_response({'error': 'Job not found'}), 404
 
     if job.get('_browser_closed') or job.get('status') not in ('captcha', 'starting', 'loading'):
-        return jsonify({'error': 'Browser not in interactive state'}), 400
+        return json_response({'error': 'Browser not in interactive state'}), 400
 
     event_queue = job.get('_event_queue')
     if not event_queue:
-        return jsonify({'error': 'Event queue not available'}), 400
+        return json_response({'error': 'Event queue not available'}), 400
 
     data = request.json
     event_queue.put(data)
-    return jsonify({'ok': True})
+    return json_response({'ok': True})
+
+
+# Fields carried by every /stream progress frame, in snapshot order
+PROGRESS_FIELDS = ('status', 'message', 'progress', 'current_page', 'max_pages', 'review_count')
+SSE_HEARTBEAT = 15  # seconds
+# Once a client has the final frame, keep the job in RAM only this long
+# (completed jobs can still be reloaded from SQLite afterwards)
+DELIVERED_JOB_TTL = 300  # seconds
 
 
 @app.route('/stream/<job_id>')
 def stream_status(job_id):
-    """Server-Sent Events for real-time progress (non-screenshot data)."""
+    """Server-Sent Events for real-time progress (non-screenshot data).
+
+    Event-driven: the generator blocks on the job's condition variable and
+    wakes as soon as the worker calls update_job(). A frame is only sent
+    when a progress field actually changed; idle jobs get a comment line
+    every SSE_HEARTBEAT seconds to keep proxies open. Clients that pass
+    ?since=<seq> (even since=0) are delta consumers: each frame carries only
+    the reviews found since the last one (new_reviews) plus seq, the total
+    delivered so far, so a reconnecting client resumes without resending
+    what it has. Without since, progress frames carry no reviews and the
+    final frame has the full reviews list, as before. The stream is gzipped
+    when the client accepts it.
+    """
+    delta_only = 'since' in request.args
+    since = max(request.args.get('since', 0, type=int), 0)
+
     def generate():
+        last_snapshot = None
+        sent_count = since
         while True:
-            if job_id not in scrape_jobs:
-                yield f"data: {json.dumps({'error': 'Job not found'})}\n\n"
+            job = get_job(job_id)
+            if job is None:
+                yield sse_data({'error': 'Job not found'})
                 break
 
-            job = scrape_jobs[job_id]
-            data = {
-                'status': job['status'],
-                'message': job['message'],
-                'progress': job['progress'],
-                'current_page': job.get('current_page', 0),
-                'max_pages': job.get('max_pages', 0),
-                'review_count': job.get('review_count', 0)
-            }
+            version = job['_version']
+            snapshot = (
+                job['status'],
+                job['message'],
+                job['progress'],
+                job.get('current_page', 0),
+                job.get('max_pages', 0),
+                job.get('review_count', 0),
+            )
 
             if job['status'] in ('complete', 'error'):
-                data['reviews'] = job.get('reviews', [])
+                data = dict(zip(PROGRESS_FIELDS, snapshot))
+                try:
+                    all_reviews = get_job_reviews(job_id, job)
+                except sqlite3.Error:
+                    yield sse_data({'error': 'Could not load reviews, please retry'})
+                    break
+                if all_reviews is None:
+                    yield sse_data({'error': 'Job not found'})
+                    break
+                if delta_only:
+                    data['new_reviews'] = all_reviews[sent_count:]
+                    data['seq'] = len(all_reviews)
+                else:
+                    data['reviews'] = all_reviews
                 data['product_title'] = job.get('product_title', '')
                 data['product_image'] = job.get('product_image', '')
-                yield f"data: {json.dumps(data)}\n\n"
+                yield sse_data(data)
+                # Only once the reviews are safely in SQLite; if persisting failed
+                # the in-memory list is the only copy and keeps the full TTL
+                if job['reviews'] is None:
+                    scrape_jobs.expire_after(job, DELIVERED_JOB_TTL)
                 break
 
-            yield f"data: {json.dumps(data)}\n\n"
-            time.sleep(0.5)
-
-    return Response(generate(), mimetype='text/event-stream',
-                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            if snapshot != last_snapshot:
+                data = dict(zip(PROGRESS_FIELDS, snapshot))
+                if delta_only:
+                    # Only the reviews appended since the previous frame
+                    live = job['reviews']
+                    if live is not None and len(live) > sent_count:
+                        data['new_reviews'] = live[sent_count:]
+                        sent_count = len(live)
+                    data['seq'] = sent_count
+                yield sse_data(data)
+                last_snapshot = snapshot
+
+            if not wait_for_job_update(job, version, SSE_HEARTBEAT):
+                yield b": keepalive\n\n"
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'Vary': 'Accept-Encoding'}
+    body = stream_with_context(generate())
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    # Hand the generator straight to the server, one chunk per frame
+    return Response(body, mimetype='text/event-stream', headers=headers, direct_passthrough=True)
 
 
 @app.route('/debug-dom/<job_id>')
 def debug_dom(job_id):
     """Return stored DOM debug info from the scraping loop."""
-    if job_id not in scrape_jobs:
-        return jsonify({'error': 'Job not found'}), 404
+    job = get_job(job_id)
+    if job is None:
+        return json_response({'error': 'Job not found'}), 404
 
-    job = scrape_jobs[job_id]
-    return jsonify({
+    return json_response({
         'dom_debug': job.get('_dom_debug', {}),
         'status': job.get('status'),
         'current_page': job.get('current_page'),
@@ -623,8 +1329,9 @@ def debug_dom(job_id):
 def debug_html(job_id):
     """Return the saved page HTML for debugging pagination."""
     html = ''
-    if job_id in scrape_jobs:
-        html = scrape_jobs[job_id].get('_page_html', '')
+    job = get_job(job_id)
+    if job is not None:
+        html = job.get('_page_html', '')
 
     # Fallback: read from file
     if not html:
@@ -651,12 +1358,21 @@ def debug_html_raw():
         return Response('No HTML saved yet', status=404)
 
 
+@app.after_request
+def set_cache_headers(response):
+    """Job state changes constantly; never let a proxy/browser cache it."""
+    if request.endpoint in ('get_status', 'debug_dom'):
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 @app.route('/health')
 def health():
     """Health check endpoint."""
-    return jsonify({'status': 'ok'})
+    return json_response({'status': 'ok'})
 
 
+# Local development only; production runs gunicorn (gunicorn.conf.py, Procfile/Dockerfile)
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'true').lower() == 'true'
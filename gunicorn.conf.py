@@ -0,0 +1,15 @@
+# Gunicorn settings for production (picked up automatically from the working dir).
+#
+# Threaded worker rather than gevent: monkey-patching threading breaks the
+# Playwright sync API used by the browser worker pool. SSE streams block on a
+# condition variable (no polling), so an idle viewer is one sleeping thread.
+# One worker process: jobs and the browser pool live in process memory.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+worker_class = 'gthread'
+workers = 1
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+# Timeout covers worker heartbeats, not request length, for gthread workers
+timeout = 300
+keepalive = 75